@@ -1,6 +1,7 @@
 from __future__ import print_function
 import os
 import socket
+from contextlib import contextmanager
 from subprocess import Popen
 
 import numpy as np
@@ -10,11 +11,43 @@ from ase.calculators.calculator import (Calculator, all_changes,
 import ase.units as units
 from ase.utils import basestring
 
+# Conversion factors between ASE units and the atomic units of the protocol
+_BOHR = units.Bohr
+_INV_BOHR = 1.0 / units.Bohr
+_HA = units.Ha
+_INV_HA = 1.0 / units.Ha
+_FORCE = units.Ha / units.Bohr  # Ha/Bohr -> eV/Ang
+_INV_FORCE = units.Bohr / units.Ha
+
 
 def actualunixsocketname(name):
     return '/tmp/ipi_{}'.format(name)
 
 
+def _configure_inet_socket(sock):
+    """Set options for IPI communication on an INET socket.
+
+    The protocol exchanges many small messages (12-byte headers), so
+    Nagle's algorithm is disabled.  Buffer sizes are left to the
+    kernel, since setting them would disable its autotuning."""
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def _inv_cell_transposed(cell):
+    """Return the transposed (pseudo)inverse of a 3x3 cell.
+
+    The rows of the result are the reciprocal cell vectors without the
+    factor 2 pi.  They are computed from cross products, which is much
+    cheaper than calling LAPACK for such a small matrix."""
+    a, b, c = cell
+    bc = np.cross(b, c)
+    det = np.dot(a, bc)
+    if abs(det) <= 1e-12 * np.prod(np.linalg.norm(cell, axis=1)):
+        # Singular, e.g. zero-length vectors for non-periodic directions
+        return np.linalg.pinv(cell).transpose()
+    return np.array([bc, np.cross(c, a), np.cross(a, b)]) / det
+
+
 class SocketClosed(OSError):
     pass
 
@@ -22,8 +55,22 @@ class SocketClosed(OSError):
 class IPIProtocol:
     """Communication using IPI protocol."""
 
+    # Encoded 12-byte headers of the messages used in the protocol
+    _headers = {msg: msg.encode('ascii').ljust(12)
+                for msg in ['STATUS', 'READY', 'NEEDINIT', 'HAVEDATA',
+                            'POSDATA', 'GETFORCE', 'FORCEREADY',
+                            'INIT', 'EXIT']}
+
     def __init__(self, socket, txt=None):
         self.socket = socket
+        # While corked, outgoing data is collected here instead of being
+        # written to the socket (see _corked()).
+        self._sendbuf = None
+        # Arrays reused for unit conversion of outgoing data:
+        self._scratch = {}
+        # The last cell sent and its inverse, since the cell usually
+        # does not change between steps:
+        self._icell_cache = (None, None)
 
         if txt is None:
             log = lambda *args: None
@@ -32,29 +79,58 @@ class IPIProtocol:
                 print('Driver:', *args, file=txt)
                 txt.flush()
         self.log = log
+        # Extra consistency checks on received data are done only when
+        # logging, since they cost another pass over every array.
+        self.debug = txt is not None
+
+    def _write(self, buf):
+        if self._sendbuf is None:
+            self.socket.sendall(buf)
+        else:
+            self._sendbuf += buf
+
+    @contextmanager
+    def _corked(self):
+        """Collect everything sent within the block and write it in one go.
+
+        A message such as POSDATA consists of a header and several arrays.
+        Sending them as a single buffer costs one system call and
+        typically one TCP segment instead of one per part."""
+        assert self._sendbuf is None
+        self._sendbuf = bytearray()
+        try:
+            yield
+            buf = self._sendbuf
+        finally:
+            self._sendbuf = None
+        self.socket.sendall(buf)
 
     def sendmsg(self, msg):
         self.log('  sendmsg', repr(msg))
         #assert msg in self.statements, msg
-        msg = msg.encode('ascii').ljust(12)
-        self.socket.sendall(msg)
+        header = self._headers.get(msg)
+        if header is None:
+            header = msg.encode('ascii').ljust(12)
+        self._write(header)
 
     def _recvall(self, nbytes):
         """Repeatedly read chunks until we have nbytes.
 
         Normally we get all bytes in one read, but that is not guaranteed."""
-        remaining = nbytes
-        chunks = []
-        while remaining > 0:
-            chunk = self.socket.recv(remaining)
-            if len(chunk) == 0:
+        msg = bytearray(nbytes)
+        self._recvall_into(memoryview(msg))
+        return msg
+
+    def _recvall_into(self, buf):
+        """Fill the writable buffer buf with bytes from the socket."""
+        nbytes = len(buf)
+        offset = 0
+        while offset < nbytes:
+            n = self.socket.recv_into(buf[offset:])
+            if n == 0:
                 # (If socket is still open, recv returns at least one byte)
                 raise SocketClosed()
-            chunks.append(chunk)
-            remaining -= len(chunk)
-        msg = b''.join(chunks)
-        assert len(msg) == nbytes and remaining == 0
-        return msg
+            offset += n
 
     def recvmsg(self):
         msg = self._recvall(12)
@@ -68,62 +144,96 @@ class IPIProtocol:
         return msg
 
     def send(self, a, dtype):
-        buf = np.asarray(a, dtype).tobytes()
+        # Send the memory of the array without copying it, unless it
+        # has the wrong type or layout:
+        a = np.ascontiguousarray(a, dtype)
+        buf = memoryview(a.reshape(-1).view(np.uint8))
         #self.log('  send {}'.format(np.array(a).ravel().tolist()))
         self.log('  send {} bytes of {}'.format(len(buf), dtype))
-        self.socket.sendall(buf)
+        self._write(buf)
+
+    def _scaled(self, name, a, factor):
+        """Return a * factor, reusing the output array between calls."""
+        a = np.asarray(a)
+        out = self._scratch.get(name)
+        if out is None or out.shape != a.shape:
+            out = self._scratch[name] = np.empty(a.shape)
+        return np.multiply(a, factor, out=out)
 
     def recv(self, shape, dtype):
         a = np.empty(shape, dtype)
-        nbytes = np.dtype(dtype).itemsize * np.prod(shape)
-        buf = self._recvall(nbytes)
-        assert len(buf) == nbytes, (len(buf), nbytes)
+        # Receive straight into the memory of the array:
+        buf = memoryview(a.reshape(-1).view(np.uint8))
+        self._recvall_into(buf)
         self.log('  recv {} bytes of {}'.format(len(buf), dtype))
-        #print(np.frombuffer(buf, dtype=dtype))
-        a.flat[:] = np.frombuffer(buf, dtype=dtype)
         #self.log('  recv {}'.format(a.ravel().tolist()))
-        assert np.isfinite(a).all()
+        if self.debug:
+            assert np.isfinite(a).all()
         return a
 
+    def recv_many(self, *specs):
+        """Receive several consecutive arrays of known size in one read.
+
+        Each spec is a (shape, dtype) pair as taken by recv().
+        Returns a list of arrays."""
+        counts = [int(np.prod(shape)) for shape, dtype in specs]
+        sizes = [count * np.dtype(dtype).itemsize
+                 for count, (shape, dtype) in zip(counts, specs)]
+        buf = bytearray(sum(sizes))
+        self._recvall_into(memoryview(buf))
+        self.log('  recv {} bytes of {}'.format(
+            len(buf), ', '.join(str(dtype) for shape, dtype in specs)))
+
+        arrays = []
+        offset = 0
+        for (shape, dtype), count, size in zip(specs, counts, sizes):
+            a = np.frombuffer(buf, dtype, count, offset).reshape(shape)
+            if self.debug:
+                assert np.isfinite(a).all()
+            arrays.append(a)
+            offset += size
+        return arrays
+
     def sendposdata(self, cell, icell, positions):
         assert cell.size == 9
         assert icell.size == 9
         assert positions.size % 3 == 0
 
         self.log(' sendposdata')
-        self.sendmsg('POSDATA')
-        self.send(cell.T / units.Bohr, np.float64)
-        self.send(icell.T * units.Bohr, np.float64)
-        self.send(len(positions), np.int32)
-        self.send(positions / units.Bohr, np.float64)
+        with self._corked():
+            self.sendmsg('POSDATA')
+            self.send(self._scaled('cell', cell.T, _INV_BOHR), np.float64)
+            self.send(self._scaled('icell', icell.T, _BOHR), np.float64)
+            self.send(len(positions), np.int32)
+            self.send(self._scaled('positions', positions, _INV_BOHR),
+                      np.float64)
 
     def recvposdata(self):
-        cell = self.recv((3, 3), np.float64).T.copy()
-        icell = self.recv((3, 3), np.float64).T.copy()
-        natoms = self.recv(1, np.int32)
+        cell, icell, natoms = self.recv_many(((3, 3), np.float64),
+                                             ((3, 3), np.float64),
+                                             (1, np.int32))
         natoms = int(natoms)
         positions = self.recv((natoms, 3), np.float64)
-        return cell * units.Bohr, icell / units.Bohr, positions * units.Bohr
+        return cell.T * _BOHR, icell.T * _INV_BOHR, positions * _BOHR
 
     def sendrecv_force(self):
         self.log(' sendrecv_force')
         self.sendmsg('GETFORCE')
         msg = self.recvmsg()
         assert msg == 'FORCEREADY', msg
-        e = self.recv(1, np.float64)[0]
-        natoms = self.recv(1, np.int32)
+        e, natoms = self.recv_many((1, np.float64), (1, np.int32))
+        e = e[0]
         assert natoms >= 0
         forces = self.recv((int(natoms), 3), np.float64)
-        virial = self.recv((3, 3), np.float64).T.copy()
-        nmorebytes = self.recv(1, np.int32)
+        virial, nmorebytes = self.recv_many(((3, 3), np.float64),
+                                            (1, np.int32))
         nmorebytes = int(nmorebytes)
         if nmorebytes > 0:
             # Receiving 0 bytes will block forever on python2.
             morebytes = self.recv(nmorebytes, np.byte)
         else:
             morebytes = b''
-        return (e * units.Ha, (units.Ha / units.Bohr) * forces,
-                units.Ha * virial, morebytes)
+        return e * _HA, _FORCE * forces, _HA * virial.T, morebytes
 
     def sendforce(self, energy, forces, virial,
                   morebytes=np.zeros(1, dtype=np.byte)):
@@ -132,17 +242,18 @@ class IPIProtocol:
         assert virial.shape == (3, 3)
 
         self.log(' sendforce')
-        self.sendmsg('FORCEREADY')  # mind the units
-        self.send(np.array([energy / units.Ha]), np.float64)
-        natoms = len(forces)
-        self.send(np.array([natoms]), np.int32)
-        self.send(units.Bohr / units.Ha * forces, np.float64)
-        self.send(1.0 / units.Ha * virial.T, np.float64)
-        # We prefer to always send at least one byte due to trouble with
-        # empty messages.  Reading a closed socket yields 0 bytes
-        # and thus can be confused with a 0-length bytestring.
-        self.send(np.array([len(morebytes)]), np.int32)
-        self.send(morebytes, np.byte)
+        with self._corked():
+            self.sendmsg('FORCEREADY')  # mind the units
+            self.send(np.array([energy * _INV_HA]), np.float64)
+            natoms = len(forces)
+            self.send(np.array([natoms]), np.int32)
+            self.send(self._scaled('forces', forces, _INV_FORCE), np.float64)
+            self.send(self._scaled('virial', virial.T, _INV_HA), np.float64)
+            # We prefer to always send at least one byte due to trouble with
+            # empty messages.  Reading a closed socket yields 0 bytes
+            # and thus can be confused with a 0-length bytestring.
+            self.send(np.array([len(morebytes)]), np.int32)
+            self.send(morebytes, np.byte)
 
     def status(self):
         self.log(' status')
@@ -165,13 +276,14 @@ class IPIProtocol:
         # XXX Not sure what this function is supposed to send.
         # It 'works' with QE, but for now we try not to call it.
         self.log(' sendinit')
-        self.sendmsg('INIT')
-        self.send(0, np.int32)  # 'bead index' always zero for now
-        # We send one byte, which is zero, since things may not work
-        # with 0 bytes.  Apparently implementations ignore the
-        # initialization string anyway.
-        self.send(1, np.int32)
-        self.send(np.zeros(1), np.byte)  # initialization string
+        with self._corked():
+            self.sendmsg('INIT')
+            self.send(0, np.int32)  # 'bead index' always zero for now
+            # We send one byte, which is zero, since things may not work
+            # with 0 bytes.  Apparently implementations ignore the
+            # initialization string anyway.
+            self.send(1, np.int32)
+            self.send(np.zeros(1), np.byte)  # initialization string
 
     def calculate(self, positions, cell):
         self.log('calculate')
@@ -182,7 +294,11 @@ class IPIProtocol:
             self.sendinit()
             msg = self.status()
         assert msg == 'READY', msg
-        icell = np.linalg.pinv(cell).transpose()
+        cell = np.asarray(cell)
+        key = cell.tobytes()
+        if key != self._icell_cache[0]:
+            self._icell_cache = (key, _inv_cell_transposed(cell))
+        icell = self._icell_cache[1]
         self.sendposdata(cell, icell, positions)
         msg = self.status()
         assert msg == 'HAVEDATA', msg
@@ -246,6 +362,9 @@ class SocketServer:
             self.serversocket = socket.socket(socket.AF_INET)
             self.serversocket.setsockopt(socket.SOL_SOCKET,
                                          socket.SO_REUSEADDR, 1)
+            # Buffer sizes must be set before listen() to be inherited
+            # by the accepted connection.
+            _configure_inet_socket(self.serversocket)
             self.serversocket.bind(('', port))
             conn_name = 'INET port {}'.format(port)
 
@@ -301,6 +420,8 @@ class SocketServer:
 
         self.serversocket.settimeout(self.timeout)
         self.clientsocket.settimeout(self.timeout)
+        if self.unixsocket is None:
+            _configure_inet_socket(self.clientsocket)
 
         if log:
             # For unix sockets, address is b''.
@@ -399,6 +520,7 @@ class SocketClient:
                 if port is None:
                     port = SocketServer.default_port
                 sock = socket.socket(socket.AF_INET)
+                _configure_inet_socket(sock)
                 sock.connect((host, port))
             sock.settimeout(timeout)
             self.host = host
@@ -548,6 +670,12 @@ class SocketIOCalculator(Calculator):
             unix socket using this name prefixed with ``/tmp/ipi_``.
             The socket is deleted when the calculator is closed.
 
+            If neither port nor unixsocket is given and the command of
+            calc contains ``{unixsocket}`` but not ``{port}``, a unix
+            socket with a unique name is used.  Client and server then
+            run on the same machine, where unix sockets are faster
+            than INET.  Otherwise the default port is used.
+
         timeout: float >= 0 or None
 
             timeout for connection, by default infinite.  See
@@ -608,6 +736,12 @@ class SocketIOCalculator(Calculator):
         return d
 
     def launch_server(self, cmd=None):
+        if (cmd is not None and self._port is None
+                and self._unixsocket is None
+                and '{unixsocket}' in cmd and '{port}' not in cmd):
+            # We launch the client ourselves, so it runs on this machine.
+            self._unixsocket = 'ase_{}_{}'.format(os.getpid(), id(self))
+
         self.server = SocketServer(client_command=cmd, port=self._port,
                                    unixsocket=self._unixsocket,
                                    timeout=self.timeout, log=self.log,
@@ -21,5 +21,5 @@ class CLICommand:
             identifier = calculation.hash.replace('/', '.')
             fname = 'nmd.{}.nomad.json'.format(identifier)
             with open(fname, 'w') as fd:
-                json.dump(calculation, fd)
+                json.dump(dict(calculation), fd)
             print(uri)
@@ -88,6 +88,10 @@ def wrap_positions(positions, cell, pbc=True, center=(0.5, 0.5, 0.5),
         shift = np.asarray(center) - 0.5
         shift[np.logical_not(pbc)] = 0.0
         fractional += shift
+    elif all(pbc):
+        # Wrap all axes at once, in place
+        fractional %= 1.0
+        fractional += shift
     else:
         for i, periodic in enumerate(pbc):
             if periodic:
@@ -150,6 +154,10 @@ def get_layers(atoms, miller, tolerance=0.001):
     return tags, levels
 
 
+# Maximum number of translated vectors examined at once by find_mic()
+_FIND_MIC_CHUNK_SIZE = 2**16
+
+
 def find_mic(D, cell, pbc=True):
     """Finds the minimum-image representation of vector(s) D"""
 
@@ -162,14 +170,24 @@ def find_mic(D, cell, pbc=True):
                              ], cell)**2).sum(1))
 
     # calculate 'mic' vectors (D) and lengths (D_len) using simple method
-    Dr = np.dot(D, np.linalg.inv(cell))
-    D = np.dot(Dr - np.round(Dr) * pbc, cell)
+    # D may have any number of leading dimensions, so solve for the
+    # scaled vectors as a flat list of vectors:
+    D = np.asarray(D)
+    Dr = np.linalg.solve(cell.T, D.reshape(-1, 3).T).T.reshape(D.shape)
+    Dr -= np.round(Dr) * pbc
+    D = np.dot(Dr, cell)
     D_len = np.sqrt((D**2).sum(1))
     # return mic vectors and lengths for only orthorhombic cells,
     # as the results may be wrong for non-orthorhombic cells
     if (max(diags) - min(diags)) / max(diags) < 1e-9:
         return D, D_len
 
+    # Check periodic neighbors iff the displacement vector in
+    # scaled coordinates (Dr) is greater than 0.5.
+    good = np.sqrt((Dr**2).sum(1)) <= 0.5
+    if good.all():
+        return D, D_len
+
     # The cutoff radius is the longest direct distance between atoms
     # or half the longest lattice diagonal, whichever is smaller
     cutoff = min(max(D_len), max(diags) / 2.)
@@ -187,43 +205,32 @@ def find_mic(D, cell, pbc=True):
     n = pbc * np.array(np.ceil(cutoff * np.prod(latt_len) /
                                (V * latt_len)), dtype=int)
 
-    # Construct a list of translation vectors. For example, if we are
+    # Construct an array of translation vectors. For example, if we are
     # searching only the nearest images (27 total), tvecs will be a
-    # 27x3 array of translation vectors. This is the only nested loop
-    # in the routine, and it takes a very small fraction of the total
-    # execution time, so it is not worth optimizing further.
-    tvecs = []
-    for i in range(-n[0], n[0] + 1):
-        latt_a = i * cell[0]
-        for j in range(-n[1], n[1] + 1):
-            latt_ab = latt_a + j * cell[1]
-            for k in range(-n[2], n[2] + 1):
-                tvecs.append(latt_ab + k * cell[2])
-    tvecs = np.array(tvecs)
-
-
-    # Check periodic neighbors iff the displacement vector in
-    # scaled coordinates is greater than 0.5.
-    good = np.sqrt((np.linalg.solve(cell.T, D.T)**2).sum(0)) <= 0.5
-
-    D_min = D.copy()
-    D_min_len = D_len.copy()
+    # 27x3 array of translation vectors.
+    ranges = np.mgrid[-n[0]:n[0] + 1, -n[1]:n[1] + 1, -n[2]:n[2] + 1]
+    tvecs = np.dot(ranges.reshape(3, -1).T, cell)
+
+    # Only vectors that are not good need to check periodic neighbors.
+    # D and D_len are our own arrays, so they can be updated in place.
+    # They are processed in chunks to limit the size of the
+    # [nvectors, ntvecs, 3] array of translated vectors.
+    bad = np.flatnonzero(~good)
+    chunksize = max(1, _FIND_MIC_CHUNK_SIZE // len(tvecs))
+    for start in range(0, len(bad), chunksize):
+        indices = bad[start:start + chunksize]
+        # Translate the direct displacement vectors by each translation
+        # vector, and calculate the corresponding squared lengths.
+        D_trans = D[indices, np.newaxis, :] + tvecs
+        D_trans_len2 = np.einsum('ijk,ijk->ij', D_trans, D_trans)
+
+        # Find mic distances and corresponding vectors.
+        rows = np.arange(len(indices))
+        D_min_ind = D_trans_len2.argmin(axis=1)
+        D[indices] = D_trans[rows, D_min_ind]
+        D_len[indices] = np.sqrt(D_trans_len2[rows, D_min_ind])
 
-    for i, (Di, gdi) in enumerate(zip(D, good)):
-        if gdi:
-            # No need to check periodic neighbors.
-            continue
-        # Translate the direct displacement vector by each translation
-        # vector, and calculate the corresponding length.
-        Di_trans = Di[np.newaxis] + tvecs
-        Di_trans_len = np.sqrt((Di_trans**2).sum(1))
-
-        # Find mic distance and corresponding vector.
-        Di_min_ind = Di_trans_len.argmin()
-        D_min[i] = Di_trans[Di_min_ind]
-        D_min_len[i] = Di_trans_len[Di_min_ind]
-
-    return D_min, D_min_len
+    return D, D_len
 
 
 def get_angles(v1, v2, cell=None, pbc=None):
@@ -245,16 +252,17 @@ def get_angles(v1, v2, cell=None, pbc=None):
         v1 = find_mic(v1, cell, pbc)[0]
         v2 = find_mic(v2, cell, pbc)[0]
 
-    nv1 = np.linalg.norm(v1, axis=1)[:, np.newaxis]
-    nv2 = np.linalg.norm(v2, axis=1)[:, np.newaxis]
-    if (nv1 <= 0).any() or (nv2 <= 0).any():
+    v1 = np.asarray(v1)
+    v2 = np.asarray(v2)
+    nv1nv2 = np.sqrt(np.einsum('ij,ij->i', v1, v1) *
+                     np.einsum('ij,ij->i', v2, v2))
+    if (nv1nv2 <= 0).any():
         raise ZeroDivisionError('Undefined angle')
-    v1 /= nv1
-    v2 /= nv2
 
-    # We just normalized the vectors, but in some cases we can get
+    # The cosines are normalized, but in some cases we can get
     # bad things like 1+2e-16.  These we clip away:
-    angles = np.arccos(np.einsum('ij,ij->i', v1, v2).clip(-1.0, 1.0))
+    cosines = np.einsum('ij,ij->i', v1, v2) / nv1nv2
+    angles = np.arccos(cosines.clip(-1.0, 1.0))
 
     return angles * f
 
@@ -270,29 +278,23 @@ def get_distances(p1, p2=None, cell=None, pbc=None):
     if p2 is None:
         p2 = p1
 
-    p1, p2 = np.array(p1), np.array(p2)
-
-    # Allocate matrix for vectors as [p1, p2, 3]
-    D = np.zeros((len(p1), len(p2), 3))
+    p1, p2 = np.asarray(p1, float), np.asarray(p2, float)
 
-    for offset, pos1 in enumerate(p1):
-        D[offset, :, :] = p2 - pos1
-
-    # Collapse to linear indexing
-    D.shape = (-1, 3)
+    # Matrix of vectors as [p1, p2, 3]
+    D = p2[np.newaxis, :, :] - p1[:, np.newaxis, :]
 
     # Check if using mic
     if cell is not None or pbc is not None:
         if cell is None or pbc is None:
             raise ValueError("cell or pbc must be both set or both be None")
 
-        D, D_len = find_mic(D, cell, pbc)
+        # find_mic works on a linear list of vectors
+        D, D_len = find_mic(D.reshape(-1, 3), cell, pbc)
+        D = D.reshape(-1, len(p2), 3)
+        D_len = D_len.reshape(-1, len(p2))
     else:
-        D_len = np.sqrt((D**2).sum(1))
-
-    # Expand back to matrix indexing
-    D.shape = (-1, len(p2), 3)
-    D_len.shape = (-1, len(p2))
+        from scipy.spatial.distance import cdist
+        D_len = cdist(p1, p2)
 
     return D, D_len
 
@@ -303,10 +305,24 @@ def get_duplicate_atoms(atoms, cutoff=0.1, delete=False):
     Identify all atoms which lie within the cutoff radius of each other.
     Delete one set of them if delete == True.
     """
-    from scipy.spatial.distance import pdist
-    dists = pdist(atoms.get_positions(), 'sqeuclidean')
-    dup = np.nonzero(dists < cutoff**2)
-    rem = np.array(_row_col_from_pdist(len(atoms), dup[0]))
+    positions = atoms.get_positions()
+    if cutoff <= 0:
+        # No distance is strictly less than the cutoff
+        rem = np.empty((0, 2), int)
+    elif len(atoms) < 2000:
+        # For small systems the full distance matrix is cheapest
+        from scipy.spatial.distance import pdist
+        dists = pdist(positions, 'sqeuclidean')
+        dup = np.nonzero(dists < cutoff**2)
+        rem = _row_col_from_pdist(len(atoms), dup[0])
+    else:
+        # Avoid the O(N^2) distance matrix for large systems.
+        # query_pairs() includes pairs at exactly the given distance,
+        # so search within the next smaller float.
+        from scipy.spatial import cKDTree
+        tree = cKDTree(positions)
+        pairs = tree.query_pairs(np.nextafter(cutoff, 0))
+        rem = np.array(sorted(pairs), dtype=int).reshape(-1, 2)
     if delete:
         if rem.size != 0:
             del atoms[rem[:, 0]]
@@ -317,12 +333,14 @@ def get_duplicate_atoms(atoms, cutoff=0.1, delete=False):
 def _row_col_from_pdist(dim, i):
     """Calculate the i,j index in the square matrix for an index in a
     condensed (triangular) matrix.
+
+    Returns an array of shape (n, 2) with one (i, j) pair per index.
     """
-    i = np.array(i)
-    b = 1 - 2 * dim
-    x = (np.floor((-b - np.sqrt(b**2 - 8 * i)) / 2)).astype(int)
-    y = (i + x * (b + x + 2) / 2 + 1).astype(int)
-    if i.shape:
-        return list(zip(x, y))
-    else:
-        return [(x, y)]
+    i = np.atleast_1d(i)
+    # Index in the condensed matrix at which each row of the square
+    # matrix starts:
+    rows = np.arange(dim - 1)
+    row_starts = rows * (2 * dim - rows - 1) // 2
+    x = np.searchsorted(row_starts, i, side='right') - 1
+    y = i - row_starts[x] + x + 1
+    return np.stack([x, y], axis=1)
@@ -1,78 +1,300 @@
+import gzip
 import json
+import os
+import tempfile
+import threading
+from collections.abc import Mapping
+from urllib.request import urlopen, Request
+
 import numpy as np
 
+try:
+    import orjson  # Much faster JSON parser, if available
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson  # pysimdjson, for lazy parsing
+except ImportError:
+    simdjson = None
+
+try:
+    import urllib3  # For reusing connections between downloads
+except ImportError:
+    urllib3 = None
+
 import ase.units as units
 from ase import Atoms
 from ase.data import chemical_symbols
 
 
+# Atomic numbers at or above this are not known elements:
+_MAX_Z = len(chemical_symbols)
+
 nomad_api_template = ('https://labdev-nomad.esc.rzg.mpg.de/'
                       'api/resolve/{hash}?format=recursiveJson')
 
 
 def nmd2https(uri):
     """Get https URI corresponding to given nmd:// URI."""
-    assert uri.startswith('nmd://')
+    if not uri.startswith('nmd://'):
+        raise ValueError('Not a NOMAD URI: {}'.format(uri))
     return nomad_api_template.format(hash=uri[6:])
 
 
-def download(uri):
-    """Download data at nmd:// URI as a NomadEntry object."""
-    try:
-        from urllib2 import urlopen
-    except ImportError:
-        from urllib.request import urlopen
-
+# Connection pool shared by all downloads, created when first needed
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Get the shared urllib3 connection pool, creating it if needed."""
+    global _pool
+    # Downloads may run in several threads (see download_many()),
+    # which must not each create their own pool:
+    with _pool_lock:
+        if _pool is None:
+            _pool = urllib3.PoolManager(maxsize=8,
+                                        retries=urllib3.Retry(3))
+        return _pool
+
+
+def _http_get(url):
+    """Return the body of the response to an HTTP GET request as bytes.
+
+    With urllib3, connections are kept open and reused by subsequent
+    requests to the same server, which saves a TCP and TLS handshake
+    per download.
+
+    The response is requested with gzip compression, which shrinks
+    the highly repetitive NOMAD JSON severalfold."""
+    headers = {'Accept-Encoding': 'gzip'}
+    if urllib3 is None:
+        response = urlopen(Request(url, headers=headers))
+        data = response.read()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return data
+
+    # urllib3 decompresses the body for us:
+    response = _get_pool().request('GET', url, headers=headers)
+    if response.status != 200:
+        raise OSError('HTTP error {} {}: {}'.format(response.status,
+                                                    response.reason, url))
+    return response.data
+
+
+def _cachefile(uri):
+    """Get name of file in the download cache for given nmd:// URI."""
+    parts = uri[6:].split('/')
+    if any(part in ['', '.', '..'] for part in parts):
+        raise ValueError('Bad NOMAD URI: {}'.format(uri))
+    cachedir = os.path.join(os.path.expanduser('~'), '.cache', 'ase', 'nomad')
+    return os.path.join(cachedir, *parts) + '.json.gz'
+
+
+def _download_data(uri):
+    """Get the JSON data at nmd:// URI as bytes.
+
+    If the environment variable ASE_NOMAD_CACHE is set to 1, downloaded
+    data is stored compressed under ~/.cache/ase/nomad, and later read
+    from there instead of downloading it again.  NOMAD entries do not
+    change once archived, so the cache needs no invalidation."""
     httpsuri = nmd2https(uri)
-    response = urlopen(httpsuri)
-    txt = response.read().decode('utf8')
-    return json.loads(txt, object_hook=lambda dct: NomadEntry(dct))
-
-
-def read(fd, _includekeys=lambda key: True):
-    """Read NomadEntry object from file."""
+    if os.environ.get('ASE_NOMAD_CACHE') != '1':
+        return _http_get(httpsuri)
+
+    fname = _cachefile(uri)
+    if os.path.isfile(fname):
+        with gzip.open(fname, 'rb') as fd:
+            return fd.read()
+
+    data = _http_get(httpsuri)
+    dirname = os.path.dirname(fname)
+    os.makedirs(dirname, exist_ok=True)
+    # Write to a temporary file and rename it, so that concurrent
+    # downloads never see an incomplete file:
+    fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fd:
+            fd.write(gzip.compress(data))
+        os.replace(tmpname, fname)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+    return data
+
+
+def download(uri, lazy=False):
+    """Download data at nmd:// URI as a NomadEntry object.
+
+    If the environment variable ASE_NOMAD_CACHE is 1, downloads are
+    cached on disk in ~/.cache/ase/nomad.
+    See read() for the meaning of lazy."""
+    # The parsers take the undecoded bytes directly:
+    txt = _download_data(uri)
+    if lazy:
+        return _loads_lazy(txt)
+    return _loads(txt)
+
+
+def download_many(uris, max_workers=8, lazy=False):
+    """Download data at several nmd:// URIs concurrently.
+
+    Yields a NomadEntry for each URI as soon as it has been downloaded,
+    so the entries do not necessarily come in the order of uris.
+    max_workers is the maximal number of simultaneous downloads.
+    See read() for the meaning of lazy."""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download, uri, lazy) for uri in uris]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Do not start remaining downloads if we stop early
+            for future in futures:
+                future.cancel()
+
+
+def read(fd, _includekeys=None, lazy=False):
+    """Read NomadEntry object from file.
+
+    If lazy is True, the file is parsed with pysimdjson, and data is
+    only converted into Python objects when accessed.  This is much
+    faster when only parts of a large entry are used, e.g., the
+    structures.  Nested sections are then read-only simdjson objects
+    rather than dictionaries."""
     # _includekeys can be used to strip unnecessary keys out of a
     # downloaded nomad file so its size is suitable for inclusion
     # in the test suite.
 
-    def hook(dct):
-        d = {k: dct[k] for k in dct if _includekeys(k)}
-        return NomadEntry(d)
-
-    dct = json.load(fd, object_hook=hook)
+    if lazy:
+        return _loads_lazy(fd.read())
+    dct = _loads(fd.read(), _includekeys)
     return dct
 
 
+def _loads(txt, includekeys=None):
+    """Parse JSON str or bytes into a NomadEntry.
+
+    If includekeys is given, keys for which includekeys(key) is False
+    are left out."""
+    # Only the root is wrapped; nested sections stay plain dicts.
+    if orjson is not None:
+        try:
+            dct = orjson.loads(txt)
+        except orjson.JSONDecodeError:
+            # orjson is strict about e.g. NaN and Infinity, which json
+            # accepts, so let json have a go as well
+            pass
+        else:
+            if includekeys is not None:
+                # orjson has no object_hook, so filter the parsed tree:
+                dct = _filterkeys(dct, includekeys)
+            return NomadEntry(dct)
+
+    if isinstance(txt, (bytes, bytearray)):
+        # json.loads() accepts bytes only from Python 3.6
+        txt = txt.decode('utf8')
+    if includekeys is None:
+        dct = json.loads(txt)
+    else:
+        def hook(dct):
+            return {k: dct[k] for k in dct if includekeys(k)}
+
+        dct = json.loads(txt, object_hook=hook)
+    return NomadEntry(dct)
+
+
+def _loads_lazy(txt):
+    """Parse JSON text lazily using pysimdjson."""
+    if simdjson is None:
+        raise ImportError('Lazy parsing of NOMAD entries requires '
+                          'pysimdjson')
+    # A parser can only hold one document at a time, and the document
+    # lives as long as any object referring to it.  Therefore each
+    # document gets its own parser.
+    return NomadEntry(simdjson.Parser().parse(txt))
+
+
+def _filterkeys(obj, includekeys):
+    """Remove keys for which includekeys(key) is False from all
+    dictionaries within obj."""
+    if isinstance(obj, dict):
+        return {k: _filterkeys(v, includekeys)
+                for k, v in obj.items() if includekeys(k)}
+    if isinstance(obj, list):
+        return [_filterkeys(v, includekeys) for v in obj]
+    return obj
+
+
+def _flat_array(data, dtype):
+    """Convert a JSON list of numbers into a new array of given dtype.
+
+    Lists from lazy parsing are copied directly from the simdjson buffer
+    rather than going through one Python object per number."""
+    if hasattr(data, 'as_buffer'):
+        buftype = {np.float64: 'd', np.int64: 'i'}[dtype]
+        return np.frombuffer(data.as_buffer(of_type=buftype), dtype).copy()
+    return np.array(data, dtype)
+
+
+def _check_section_system(section):
+    name = section['name']
+    if name != 'section_system':
+        raise ValueError('Expected section_system, got {}'.format(name))
+
+
+def _atomic_numbers(section):
+    """Get atomic numbers of section_system as an array."""
+    numbers = _flat_array(section['atom_species'], np.int64)
+    # We don't support Z < 0 or unknown elements:
+    return np.where((numbers < 0) | (numbers >= _MAX_Z), 0, numbers)
+
+
 def section_system_to_atoms(section):
     """Covnert section_system into an Atoms object."""
-    assert section['name'] == 'section_system'
-    numbers = section['atom_species']
-    numbers = np.array(numbers, int)
-    numbers[numbers < 0] = 0  # We don't support Z < 0
-    numbers[numbers >= len(chemical_symbols)] = 0
-    positions = section['atom_positions']['flatData']
-    positions = np.array(positions).reshape(-1, 3) * units.m
-    atoms = Atoms(numbers, positions=positions)
-    atoms.info['nomad_uri'] = section['uri']
+    _check_section_system(section)
+    numbers = _atomic_numbers(section)
+    positions = _flat_array(section['atom_positions']['flatData'], np.float64)
+    positions *= units.m  # in place, since the array is a fresh copy
+    positions = positions.reshape(-1, 3)
 
     pbc = section.get('configuration_periodic_dimensions')
     if pbc is not None:
-        assert len(pbc) == 1
-        pbc = pbc[0]  # it's a list??
-        pbc = pbc['flatData']
-        assert len(pbc) == 3
-        atoms.pbc = pbc
+        pbc = pbc[0]['flatData']  # it's a list??
+        if len(pbc) != 3:
+            raise ValueError('Expected 3 periodic dimensions, got {}'
+                             .format(len(pbc)))
 
     # celldisp?
     cell = section.get('lattice_vectors')
     if cell is not None:
-        cell = cell['flatData']
-        cell = np.array(cell).reshape(3, 3) * units.m
-        atoms.cell = cell
+        cell = _flat_array(cell['flatData'], np.float64)
+        cell *= units.m
+        cell = cell.reshape(3, 3)
 
+    atoms = Atoms(numbers, positions=positions, cell=cell, pbc=pbc)
+    atoms.info['nomad_uri'] = section['uri']
     return atoms
 
 
+def section_system_to_soa(section):
+    """Get atomic numbers and x, y and z coordinates of section_system.
+
+    Returns the arrays (numbers, xs, ys, zs) with coordinates in Angstrom.
+    This avoids creating an Atoms object, and gives each Cartesian
+    component as a separate array for code which works on one component
+    at a time.  The coordinate arrays are strided views into a single
+    array of positions, so they are not contiguous."""
+    _check_section_system(section)
+    numbers = _atomic_numbers(section)
+    flat = _flat_array(section['atom_positions']['flatData'], np.float64)
+    flat *= units.m
+    return numbers, flat[0::3], flat[1::3], flat[2::3]
+
+
 def nomad_entry_to_images(section):
     """Yield the images from a Nomad entry.
 
@@ -80,25 +302,49 @@ def nomad_entry_to_images(section):
     One atoms object will be yielded for each section_system."""
 
 
-class NomadEntry(dict):
+class NomadEntry(Mapping):
     """An entry from the Nomad database.
 
     The Nomad entry is represented as nested dictionaries and lists.
 
-    ASE converts each dictionary into a NomadEntry object which supports
-    different actions.  Some actions are only available when the NomadEntry
-    represents a particular section."""
+    A NomadEntry is a read-only view of one of these dictionaries which
+    supports different actions.  Some actions are only available when the
+    NomadEntry represents a particular section.  The entries returned by
+    read() and download() represent whole calculations.  Sections within
+    them are plain dictionaries, which can be wrapped as NomadEntry(section)
+    to use the actions."""
+    __slots__ = ['_dct']
+
     def __init__(self, dct):
         #assert dct['type'] == 'nomad_calculation_2_0'
         #assert dct['name'] == 'calculation_context'
-        # We could implement NomadEntries that represent sections.
-        dict.__init__(self, dct)
+        self._dct = dct
+
+    def __getitem__(self, key):
+        return self._dct[key]
+
+    def __contains__(self, key):
+        return key in self._dct
+
+    def __iter__(self):
+        return iter(self._dct)
+
+    def __len__(self):
+        return len(self._dct)
+
+    def get(self, key, default=None):
+        return self._dct.get(key, default)
+
+    def __repr__(self):
+        return 'NomadEntry({!r})'.format(self._dct)
 
     @property
     def hash(self):
         # The hash is a string, so not __hash__
-        assert self['uri'].startswith('nmd://')
-        return self['uri'][6:]
+        uri = self['uri']
+        if not uri.startswith('nmd://'):
+            raise ValueError('Not a NOMAD URI: {}'.format(uri))
+        return uri[6:]
 
     def toatoms(self):
         """Convert this NomadEntry into an Atoms object.
@@ -106,28 +352,52 @@ class NomadEntry(dict):
         This NomadEntry must represent a section_system."""
         return section_system_to_atoms(self)
 
+    def _run_sections(self):
+        if 'section_run' in self:
+            return self['section_run']
+        name = self.get('name')
+        if name != 'section_run':
+            raise ValueError('Expected section_run or an entry containing '
+                             'one, got {}'.format(name))
+        return [self]  # We assume that we are the section_run
+
+    def _calculation_info(self):
+        if self.get('name') == 'calculation_context':
+            return {'nomad_calculation_uri': self['uri']}
+        return {}
+
     def iterimages(self):
         """Yield Atoms object contained within this NomadEntry.
 
         This NomadEntry must represent or contain a section_run."""
-
-        if 'section_run' in self:
-            run_sections = self['section_run']
-        else:
-            assert self['name'] == 'section_run'
-            run_sections = [self]  # We assume that we are the section_run
-
-        for run in run_sections:
+        calculation_info = self._calculation_info()
+        for run in self._run_sections():
+            # Info common to all images of this run:
+            run_info = {'nomad_run_gIndex': run['gIndex']}
+            run_info.update(calculation_info)
             systems = run['section_system']
             for system in systems:
                 atoms = section_system_to_atoms(system)
-                atoms.info['nomad_run_gIndex'] = run['gIndex']
+                atoms.info.update(run_info)
                 atoms.info['nomad_system_gIndex'] = system['gIndex']
-
-                if self.get('name') == 'calculation_context':
-                    atoms.info['nomad_calculation_uri'] = self['uri']
                 yield atoms
 
+    def get_image(self, run_index=0, system_index=0):
+        """Get one Atoms object contained within this NomadEntry.
+
+        Only the section_system with the given index within the
+        section_run with the given index is converted.  With lazy
+        parsing, the other sections are never read.
+
+        This NomadEntry must represent or contain a section_run."""
+        run = self._run_sections()[run_index]
+        system = run['section_system'][system_index]
+        atoms = section_system_to_atoms(system)
+        atoms.info['nomad_run_gIndex'] = run['gIndex']
+        atoms.info.update(self._calculation_info())
+        atoms.info['nomad_system_gIndex'] = system['gIndex']
+        return atoms
+
 
 def main():
     uri = "nmd://N9Jqc1y-Bzf7sI1R9qhyyyoIosJDs/C74RJltyQeM9_WFuJYO49AR4gKuJ2"
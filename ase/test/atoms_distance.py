@@ -49,3 +49,9 @@ a.set_distance(0, 1, 0.9, add=True)
 new = a.get_distance(0, 1)
 diff = new - old - 0.9
 assert abs(diff) < 10e-6
+
+# Distance vectors are float even for integer positions
+from ase.geometry import get_distances
+D, D_len = get_distances([[0, 0, 0]], [[1, 2, 2]])
+assert D.dtype == float and D_len.dtype == float
+assert D_len[0, 0] == 3.0
@@ -25,3 +25,41 @@ get_duplicate_atoms(at, delete=True)
 dups = get_duplicate_atoms(at)
 
 assert dups.size == 0
+
+# Large systems use a k-d tree instead of the full distance matrix.
+# Compare with the pairs found from the distance matrix, including
+# pairs exactly at the cutoff, which are not duplicates.
+import numpy as np
+from scipy.spatial.distance import pdist
+
+rng = np.random.RandomState(17)
+grid = np.indices((13, 13, 13)).reshape(3, -1).T * 1.0
+grid = grid[rng.permutation(len(grid))]
+positions = np.concatenate([grid,
+                            grid[:20] + rng.rand(20, 3) * 0.2,
+                            grid[20:25] + [0.5, 0, 0]])
+at = Atoms('H{}'.format(len(positions)), positions=positions)
+assert len(at) >= 2000
+
+cutoff = 0.5
+i, j = np.triu_indices(len(at), 1)
+isdup = pdist(positions, 'sqeuclidean') < cutoff**2
+dups = get_duplicate_atoms(at, cutoff=cutoff)
+assert np.array_equal(dups, np.array([i[isdup], j[isdup]]).T)
+assert np.array_equal(dups, [[n, len(grid) + n] for n in range(20)])
+
+# Same pairs as for a small system, which uses the distance matrix:
+indices = np.concatenate([np.arange(100), np.arange(len(grid), len(at))])
+dups_small = get_duplicate_atoms(at[indices], cutoff=cutoff)
+assert np.array_equal(indices[dups_small], dups)
+
+get_duplicate_atoms(at, cutoff=cutoff, delete=True)
+assert len(at) == len(positions) - 20
+
+# Coincident atoms are not closer than a cutoff of zero, for small
+# and large systems alike:
+for natoms in [2, 2500]:
+    at = Atoms('H{}'.format(natoms),
+               positions=np.arange(natoms * 3).reshape(-1, 3))
+    at.positions[1] = at.positions[0]
+    assert get_duplicate_atoms(at, cutoff=0).shape == (0, 2)
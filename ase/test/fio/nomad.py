@@ -8,6 +8,8 @@ fname = 'nmd.test.nomad.json'
 with open(fname, 'w') as fd:
     fd.write(nomad_data)
 
+import numpy as np
+
 from ase.io import iread
 
 images = list(iread(fname))
@@ -18,6 +20,111 @@ for atoms in images:
     assert (atoms.cell > 0).sum() == 3
     assert atoms.get_chemical_formula() == 'As24Sr32'
 
+from ase.nomad import NomadEntry, read, section_system_to_soa
+with open(fname) as fd:
+    entry = read(fd)
+numbers, xs, ys, zs = section_system_to_soa(
+    entry['section_run'][0]['section_system'][0])
+assert (numbers == images[0].numbers).all()
+assert np.allclose(np.array([xs, ys, zs]).T, images[0].positions)
+
+atoms = entry.get_image(system_index=2)
+assert atoms == images[2]
+assert atoms.info == images[2].info
+
+assert repr(NomadEntry({'a': 1})) == "NomadEntry({'a': 1})"
+
+try:
+    list(NomadEntry({'name': 'section_system'}).iterimages())
+except ValueError:
+    pass
+else:
+    assert False, 'Entry without section_run should raise ValueError'
+
+# NaN and Infinity are not strict JSON, but are written by json.dump():
+from io import StringIO
+entry = read(StringIO('{"a": NaN, "b": [Infinity]}'))
+assert np.isnan(entry['a']) and entry['b'] == [np.inf]
+
+# Downloads are cached on disk when ASE_NOMAD_CACHE is 1:
+import os
+import tempfile
+import ase.nomad
+
+downloads = []
+
+
+def fake_http_get(url):
+    downloads.append(url)
+    return nomad_data.encode()
+
+
+http_get = ase.nomad._http_get
+environ = os.environ.copy()
+ase.nomad._http_get = fake_http_get
+try:
+    os.environ['HOME'] = tempfile.mkdtemp()
+    os.environ['ASE_NOMAD_CACHE'] = '1'
+    uri = 'nmd://N9Jqc1y-Bzf7sI1R9qhyyyoIosJDs/C74RJltyQeM9_WFuJYO49AR4gKuJ2'
+    for i in range(2):
+        assert ase.nomad.download(uri)['uri'] == uri
+        assert len(downloads) == 1
+    cachedir = os.path.join(os.environ['HOME'], '.cache', 'ase', 'nomad')
+    assert os.path.isfile(os.path.join(cachedir, uri[6:] + '.json.gz'))
+    assert not any(name.endswith('.tmp')
+                   for dirpath, dirnames, names in os.walk(cachedir)
+                   for name in names)
+    try:
+        ase.nomad.download('nmd://../x')
+    except ValueError:
+        pass
+    else:
+        assert False, 'Bad URI should raise ValueError'
+    assert len(downloads) == 1
+finally:
+    ase.nomad._http_get = http_get
+    os.environ.clear()
+    os.environ.update(environ)
+
+# download_many() yields each entry once, and stops downloading when
+# the caller stops early:
+started = []
+
+
+def fake_download(uri, lazy=False):
+    started.append(uri)
+    return uri
+
+
+download = ase.nomad.download
+ase.nomad.download = fake_download
+try:
+    uris = ['nmd://{}'.format(i) for i in range(10)]
+    assert sorted(ase.nomad.download_many(uris)) == sorted(uris)
+    assert sorted(started) == sorted(uris)
+
+    del started[:]
+    for uri in ase.nomad.download_many(uris, max_workers=1):
+        break
+    # At most the download in progress while stopping may have started:
+    assert len(started) <= 2, started
+finally:
+    ase.nomad.download = download
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+if simdjson is not None:
+    with open(fname) as fd:
+        entry = read(fd, lazy=True)
+    lazy_images = list(entry.iterimages())
+    assert len(lazy_images) == 3
+    for atoms, lazy_atoms in zip(images, lazy_images):
+        assert atoms == lazy_atoms
+        assert atoms.info == lazy_atoms.info
+
 
 # Code for cleaning up nomad files so their size is reasonable for inclusion
 # in test suite:
@@ -31,5 +138,5 @@ includekeys = lambda k: k in ourkeys
 fname = ...
 with open(fname) as fd:
     d = read(fd, includekeys=includekeys)
-print(json.dumps(d))
+print(json.dumps(dict(d)))
 """
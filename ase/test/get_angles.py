@@ -11,3 +11,11 @@ manual_results = [g.get_angle(a1, a2, a3, mic=True)
 set_results = g.get_angles(test_set, mic=True)
 
 assert(np.allclose(manual_results, set_results))
+
+# get_angles from ase.geometry must not modify the vectors it is given
+from ase.geometry import get_angles
+v1 = np.array([[1.0, 0.0, 0.0], [2.0, 2.0, 0.0]])
+v2 = np.array([[0.0, 3.0, 0.0], [1.0, 0.0, 0.0]])
+v1_orig, v2_orig = v1.copy(), v2.copy()
+assert np.allclose(get_angles(v1, v2), [90.0, 45.0])
+assert (v1 == v1_orig).all() and (v2 == v2_orig).all()
@@ -0,0 +1,68 @@
+import socket
+import threading
+
+import numpy as np
+
+import ase.calculators.socketio as socketio
+from ase.calculators.socketio import IPIProtocol
+
+# The driver should invert the cell only when it changes, and should
+# reuse its unit conversion arrays between steps.
+
+ninversions = [0]
+inv_cell_transposed = socketio._inv_cell_transposed
+
+
+def counting_inv_cell_transposed(cell):
+    ninversions[0] += 1
+    return inv_cell_transposed(cell)
+
+
+socketio._inv_cell_transposed = counting_inv_cell_transposed
+
+nsteps = 3
+natoms = 4
+cell = np.diag([4.0, 5.0, 6.0])
+rng = np.random.RandomState(42)
+server_sock, client_sock = socket.socketpair()
+# Fail rather than hang if either side stops talking:
+server_sock.settimeout(10.0)
+client_sock.settimeout(10.0)
+
+
+def run_client():
+    client = IPIProtocol(client_sock)
+    for step in range(nsteps):
+        assert client.recvmsg() == 'STATUS'
+        client.sendmsg('READY')
+        assert client.recvmsg() == 'POSDATA'
+        client_cell, client_icell, positions = client.recvposdata()
+        assert np.allclose(client_cell, cell)
+        assert np.allclose(client_icell, np.linalg.inv(cell).T)
+        assert client.recvmsg() == 'STATUS'
+        client.sendmsg('HAVEDATA')
+        assert client.recvmsg() == 'GETFORCE'
+        client.sendforce(1.0, -positions, np.zeros((3, 3)))
+
+
+thread = threading.Thread(target=run_client)
+thread.start()
+try:
+    server = IPIProtocol(server_sock)
+    for step in range(nsteps):
+        positions = rng.rand(natoms, 3)
+        results = server.calculate(positions, cell.copy())
+        assert np.allclose(results['forces'], -positions)
+        if step == 0:
+            scratch = dict(server._scratch)
+            icell = server._icell_cache[1]
+        assert server._icell_cache[1] is icell
+        assert all(server._scratch[name] is a
+                   for name, a in scratch.items())
+finally:
+    server_sock.close()
+    thread.join()
+    client_sock.close()
+    socketio._inv_cell_transposed = inv_cell_transposed
+
+assert ninversions[0] == 1, ninversions[0]
@@ -113,3 +113,13 @@ assert abs(a.get_distance(0, 1, mic=True) - np.sqrt(46)) < tol
 # set_distance(mic=True)
 a.set_distance(0, 1, 3., mic=True)
 assert abs(a.get_distance(0, 1, mic=True) - 3.) < tol
+
+# find_mic() also takes arrays of vectors with more than two dimensions,
+# as done by e.g. FixLinearTriatomic
+from ase.geometry import find_mic
+ortho_cell = np.diag([4., 5., 6.])
+D = (np.random.RandomState(3).rand(2, 4, 3) - 0.5) * 20
+D_mic = find_mic(D, ortho_cell, pbc=True)[0]
+assert D_mic.shape == D.shape
+for Di, Di_mic in zip(D, D_mic):
+    assert np.allclose(find_mic(Di, ortho_cell, pbc=True)[0], Di_mic)